@@ -2,6 +2,7 @@
 import argparse
 import json
 import sys
+from array import array
 from os import path
 
 location_types = dict()
@@ -44,114 +45,68 @@ def gfx_wire_alias(old, new):
     gfx_wire_ids[new] = gfx_wire_ids[old]
 
 
+# Wire types by the part of the wire name after its last underscore
+wire_type_suffixes = {
+    "SLICE": "WIRE_TYPE_SLICE",
+    "DQS": "WIRE_TYPE_DQS",
+    "IOLOGIC": "WIRE_TYPE_IOLOGIC",
+    "SIOLOGIC": "WIRE_TYPE_SIOLOGIC",
+    "PIO": "WIRE_TYPE_PIO",
+    "DDRDLL": "WIRE_TYPE_DDRDLL",
+    "CCLK": "WIRE_TYPE_CCLK",
+    "EXTREF": "WIRE_TYPE_EXTREF",
+    "DCU": "WIRE_TYPE_DCU",
+    "EBR": "WIRE_TYPE_EBR",
+    "MULT18": "WIRE_TYPE_MULT18",
+    "ALU54": "WIRE_TYPE_ALU54",
+    "PLL": "WIRE_TYPE_PLL",
+    "SED": "WIRE_TYPE_SED",
+    "OSC": "WIRE_TYPE_OSC",
+    "JTAG": "WIRE_TYPE_JTAG",
+    "GSR": "WIRE_TYPE_GSR",
+    "DTR": "WIRE_TYPE_DTR",
+    "PCSCLKDIV0": "WIRE_TYPE_PCSCLKDIV",
+    "PCSCLKDIV1": "WIRE_TYPE_PCSCLKDIV",
+}
+
+# Wire types by the first three characters of the wire name
+wire_type_short_prefixes = {
+    "H00": "WIRE_TYPE_H00",
+    "H01": "WIRE_TYPE_H01",
+    "HFI": "WIRE_TYPE_H01",
+    "HL7": "WIRE_TYPE_H01",
+    "H02": "WIRE_TYPE_H02",
+    "H06": "WIRE_TYPE_H06",
+    "V00": "WIRE_TYPE_V00",
+    "V01": "WIRE_TYPE_V01",
+    "V02": "WIRE_TYPE_V02",
+    "V06": "WIRE_TYPE_V06",
+}
+
+# Wire types by the first six characters of the wire name
+wire_type_long_prefixes = {
+    "G_HPBX": "WIRE_TYPE_G_HPBX",
+    "G_VPTX": "WIRE_TYPE_G_VPTX",
+    "L_HPBX": "WIRE_TYPE_L_HPBX",
+    "R_HPBX": "WIRE_TYPE_R_HPBX",
+}
+
 def wire_type(name):
-    longname = name
     name = name.split('/')
 
     if name[0].startswith("X") and name[1].startswith("Y"):
         name = name[2:]
 
-    if name[0].endswith("_SLICE"):
-        return "WIRE_TYPE_SLICE"
-
-    if name[0].endswith("_DQS"):
-        return "WIRE_TYPE_DQS"
-
-    if name[0].endswith("_IOLOGIC"):
-        return "WIRE_TYPE_IOLOGIC"
-
-    if name[0].endswith("_SIOLOGIC"):
-        return "WIRE_TYPE_SIOLOGIC"
-
-    if name[0].endswith("_PIO"):
-        return "WIRE_TYPE_PIO"
-
-    if name[0].endswith("_DDRDLL"):
-        return "WIRE_TYPE_DDRDLL"
-
-    if name[0].endswith("_CCLK"):
-        return "WIRE_TYPE_CCLK"
-
-    if name[0].endswith("_EXTREF"):
-        return "WIRE_TYPE_EXTREF"
-
-    if name[0].endswith("_DCU"):
-        return "WIRE_TYPE_DCU"
-
-    if name[0].endswith("_EBR"):
-        return "WIRE_TYPE_EBR"
-
-    if name[0].endswith("_MULT18"):
-        return "WIRE_TYPE_MULT18"
-
-    if name[0].endswith("_ALU54"):
-        return "WIRE_TYPE_ALU54"
-
-    if name[0].endswith("_PLL"):
-        return "WIRE_TYPE_PLL"
-
-    if name[0].endswith("_SED"):
-        return "WIRE_TYPE_SED"
+    name = name[0]
+    _, sep, suffix = name.rpartition("_")
+    if sep and suffix in wire_type_suffixes:
+        return wire_type_suffixes[suffix]
 
-    if name[0].endswith("_OSC"):
-        return "WIRE_TYPE_OSC"
+    if name[:3] in wire_type_short_prefixes:
+        return wire_type_short_prefixes[name[:3]]
 
-    if name[0].endswith("_JTAG"):
-        return "WIRE_TYPE_JTAG"
-
-    if name[0].endswith("_GSR"):
-        return "WIRE_TYPE_GSR"
-
-    if name[0].endswith("_DTR"):
-        return "WIRE_TYPE_DTR"
-
-    if name[0].endswith("_PCSCLKDIV0"):
-        return "WIRE_TYPE_PCSCLKDIV"
-
-    if name[0].endswith("_PCSCLKDIV1"):
-        return "WIRE_TYPE_PCSCLKDIV"
-
-    if name[0].startswith("H00"):
-        return "WIRE_TYPE_H00"
-
-    if name[0].startswith("H01"):
-        return "WIRE_TYPE_H01"
-
-    if name[0].startswith("HFI"):
-        return "WIRE_TYPE_H01"
-
-    if name[0].startswith("HL7"):
-        return "WIRE_TYPE_H01"
-
-    if name[0].startswith("H02"):
-        return "WIRE_TYPE_H02"
-
-    if name[0].startswith("H06"):
-        return "WIRE_TYPE_H06"
-
-    if name[0].startswith("V00"):
-        return "WIRE_TYPE_V00"
-
-    if name[0].startswith("V01"):
-        return "WIRE_TYPE_V01"
-
-    if name[0].startswith("V02"):
-        return "WIRE_TYPE_V02"
-
-    if name[0].startswith("V06"):
-        return "WIRE_TYPE_V06"
-
-    if name[0].startswith("G_HPBX"):
-        return "WIRE_TYPE_G_HPBX"
-
-    if name[0].startswith("G_VPTX"):
-        return "WIRE_TYPE_G_VPTX"
-
-    if name[0].startswith("L_HPBX"):
-        return "WIRE_TYPE_L_HPBX"
-
-    if name[0].startswith("R_HPBX"):
-        return "WIRE_TYPE_R_HPBX"
+    if name[:6] in wire_type_long_prefixes:
+        return wire_type_long_prefixes[name[:6]]
 
     return "WIRE_TYPE_NONE"
 
@@ -172,71 +127,123 @@ constids = dict()
 
 
 class BinaryBlobAssembler:
+    # Output lines are buffered and written out in large chunks, as printing
+    # each field separately dominates the runtime for the larger devices
+    def __init__(self):
+        self.out = []
+        # bbasm writes out a new copy of a string for every "str", so strings
+        # that have already been emitted are referenced by their label instead
+        self.strings = set()
+
+    def flush(self):
+        # the output is plain ASCII, so write it to the binary stream and skip
+        # the text layer's encoding and newline handling
+        sys.stdout.buffer.write("".join(self.out).encode())
+        self.out = []
+
     def l(self, name, ltype = None, export = False):
+        if len(self.out) >= 65536:
+            self.flush()
         if ltype is None:
-            print("label %s" % (name,))
+            self.out.append("label %s\n" % (name,))
         else:
-            print("label %s %s" % (name, ltype))
+            self.out.append("label %s %s\n" % (name, ltype))
 
     def r(self, name, comment):
         if comment is None:
-            print("ref %s" % (name,))
+            self.out.append("ref %s\n" % (name,))
         else:
-            print("ref %s %s" % (name, comment))
+            self.out.append("ref %s %s\n" % (name, comment))
 
     def r_slice(self, name, length, comment):
         if comment is None:
-            print("ref %s" % (name,))
+            self.out.append("ref %s\nu32 %d\n" % (name, length))
         else:
-            print("ref %s %s" % (name, comment))
-        print ("u32 %d" % (length, ))
+            self.out.append("ref %s %s\nu32 %d\n" % (name, comment, length))
 
     def s(self, s, comment):
+        if s in self.strings:
+            self.out.append("ref str:%s %s\n" % (s, comment))
+            return
         assert "|" not in s
-        print("str |%s| %s" % (s, comment))
+        # labels are whitespace delimited, so only non-empty strings without any
+        # whitespace (including leading or trailing) can be referenced
+        if s.split() == [s]:
+            self.strings.add(s)
+        self.out.append("str |%s| %s\n" % (s, comment))
 
     def u8(self, v, comment):
         assert -128 <= int(v) <= 127
         if comment is None:
-            print("u8 %d" % (v,))
+            self.out.append("u8 %d\n" % (v,))
         else:
-            print("u8 %d %s" % (v, comment))
+            self.out.append("u8 %d %s\n" % (v, comment))
 
     def u16(self, v, comment):
         # is actually used as signed 16 bit
         assert -32768 <= int(v) <= 32767
         if comment is None:
-            print("u16 %d" % (v,))
+            self.out.append("u16 %d\n" % (v,))
         else:
-            print("u16 %d %s" % (v, comment))
+            self.out.append("u16 %d %s\n" % (v, comment))
 
     def u32(self, v, comment):
         if comment is None:
-            print("u32 %d" % (v,))
+            self.out.append("u32 %d\n" % (v,))
         else:
-            print("u32 %d %s" % (v, comment))
+            self.out.append("u32 %d %s\n" % (v, comment))
 
     def pre(self, s):
-        print("pre %s" % s)
+        self.out.append("pre %s\n" % s)
 
     def post(self, s):
-        print("post %s" % s)
+        self.out.append("post %s\n" % s)
 
     def push(self, name):
-        print("push %s" % name)
+        self.out.append("push %s\n" % name)
 
     def pop(self):
-        print("pop")
-
-def get_bel_index(ddrg, loc, name):
-    loctype = ddrg.locationTypes[ddrg.typeAtLocation[loc]]
-    idx = 0
-    for bel in loctype.bels:
-        if ddrg.to_str(bel.name) == name:
-            return idx
-        idx += 1
-    assert loc.y == max_row # Only missing IO should be special pins at bottom of device
-    return None
+        self.out.append("pop\n")
+
+# Get the string for a routing graph id, caching to avoid repeated pytrellis calls
+id_strings = dict()
+
+def get_id_str(ddrg, id):
+    if id in id_strings:
+        return id_strings[id]
+    s = ddrg.to_str(id)
+    id_strings[id] = s
+    return s
+
+
+# Get the constid for a routing graph id, such as a bel type or pin name
+id_constids = dict()
+
+def get_id_constid(ddrg, id):
+    if id in id_constids:
+        return id_constids[id]
+    c = constids[get_id_str(ddrg, id)]
+    id_constids[id] = c
+    return c
+
+
+# Bel name to bel index maps, keyed by (x, y) location
+bel_indices = dict()
+
+def build_bel_indices(ddrg, locs):
+    loctype_bels = dict()
+    for x, y in locs:
+        lt = ddrg.typeAtLocation[pytrellis.Location(x, y)]
+        if lt not in loctype_bels:
+            loctype = ddrg.locationTypes[lt]
+            loctype_bels[lt] = {get_id_str(ddrg, bel.name): idx for idx, bel in enumerate(loctype.bels)}
+        bel_indices[x, y] = loctype_bels[lt]
+
+def get_bel_index(x, y, name):
+    idx = bel_indices[x, y].get(name)
+    if idx is None:
+        assert y == max_row # Only missing IO should be special pins at bottom of device
+    return idx
 
 
 packages = {}
@@ -246,21 +253,22 @@ def process_pio_db(ddrg, device):
     piofile = path.join(database.get_db_root(), "ECP5", dev_names[device], "iodb.json")
     with open(piofile, 'r') as f:
         piodb = json.load(f)
+        pio_xys = set((pinloc["col"], pinloc["row"]) for pkgdata in piodb["packages"].values() for pinloc in pkgdata.values())
+        pio_xys.update((metaitem["col"], metaitem["row"]) for metaitem in piodb["pio_metadata"])
+        build_bel_indices(ddrg, pio_xys)
         for pkgname, pkgdata in sorted(piodb["packages"].items()):
             pins = []
             for name, pinloc in sorted(pkgdata.items()):
                 x = pinloc["col"]
                 y = pinloc["row"]
-                loc = pytrellis.Location(x, y)
                 pio = "PIO" + pinloc["pio"]
-                bel_idx = get_bel_index(ddrg, loc, pio)
+                bel_idx = get_bel_index(x, y, pio)
                 if bel_idx is not None:
-                    pins.append((name, loc, bel_idx))
+                    pins.append((name, x, y, bel_idx))
             packages[pkgname] = pins
         for metaitem in piodb["pio_metadata"]:
             x = metaitem["col"]
             y = metaitem["row"]
-            loc = pytrellis.Location(x, y)
             pio = "PIO" + metaitem["pio"]
             bank = metaitem["bank"]
             if "function" in metaitem:
@@ -278,23 +286,33 @@ def process_pio_db(ddrg, device):
                 while tdqs[-(suffix_size+1)].isdigit():
                     suffix_size += 1
                 dqs |= int(tdqs[-suffix_size:])
-            bel_idx = get_bel_index(ddrg, loc, pio)
+            bel_idx = get_bel_index(x, y, pio)
             if bel_idx is not None:
-                pindata.append((loc, bel_idx, bank, pinfunc, dqs))
-
-global_data = {}
-quadrants = ["UL", "UR", "LL", "LR"]
+                pindata.append((x, y, bel_idx, bank, pinfunc, dqs))
+
+# Global routing info for each location, indexed by y * (max_col + 1) + x
+global_quad = array("B")
+global_tap_dir = array("B")
+global_tap_col = array("h")
+global_spine_row = array("h")
+global_spine_col = array("h")
+quadrants = {"UL": 0, "UR": 1, "LL": 2, "LR": 3}
 def process_loc_globals(chip):
     for y in range(0, max_row+1):
         for x in range(0, max_col+1):
             quad = chip.global_data.get_quadrant(y, x)
             tapdrv = chip.global_data.get_tap_driver(y, x)
-            if tapdrv.col == x:
+            tap_col = tapdrv.col
+            if tap_col == x:
                 spinedrv = chip.global_data.get_spine_driver(quad, x)
-                spine = (spinedrv.second, spinedrv.first)
+                global_spine_row.append(spinedrv.first)
+                global_spine_col.append(spinedrv.second)
             else:
-                spine = (-1, -1)
-            global_data[x, y] = (quadrants.index(quad), int(tapdrv.dir), tapdrv.col, spine)
+                global_spine_row.append(-1)
+                global_spine_col.append(-1)
+            global_quad.append(quadrants[quad])
+            global_tap_dir.append(int(tapdrv.dir))
+            global_tap_col.append(tap_col)
 
 
 speed_grade_names = ["6", "7", "8", "8_5G"]
@@ -449,213 +467,283 @@ def write_database(dev_name, chip, ddrg, endianness):
         bba.u16(loc.y, "%s.y" % sym_name)
 
     loctypes = list([_.key() for _ in ddrg.locationTypes])
+    loctype_idx = {k: i for i, k in enumerate(loctypes)}
+    # Location type index at each grid location, looked up from pytrellis only once
+    loctype_at = [[loctype_idx[ddrg.typeAtLocation[pytrellis.Location(x, y)]] for x in range(max_col+1)]
+                  for y in range(max_row+1)]
     loc_with_type = {}
     for y in range(0, max_row+1):
         for x in range(0, max_col+1):
-            loc_with_type[loctypes.index(ddrg.typeAtLocation[pytrellis.Location(x, y)])] = (x, y)
+            loc_with_type[loctype_at[y][x]] = (x, y)
+
+    # Wire names and wire type constids for every location type, computed once per wire
+    # rather than once per pip that uses the wire
+    wire_type_ids = {}
+    loctype_wire_names = []
+    loctype_wire_types = []
+    for lt in loctypes:
+        names = [get_id_str(ddrg, wire.name) for wire in ddrg.locationTypes[lt].wires]
+        for name in names:
+            if name not in wire_type_ids:
+                wire_type_ids[name] = constids[wire_type(name)]
+        loctype_wire_names.append(names)
+        loctype_wire_types.append([wire_type_ids[name] for name in names])
 
     def get_wire_name(arc_loctype, rel, idx):
         loc = loc_with_type[arc_loctype]
-        lt = ddrg.typeAtLocation[pytrellis.Location(loc[0] + rel.x, loc[1] + rel.y)]
-        wire = ddrg.locationTypes[lt].wires[idx]
-        return "R{}C{}_{}".format(loc[1] + rel.y, loc[0] + rel.x, ddrg.to_str(wire.name))
+        x = loc[0] + rel.x
+        y = loc[1] + rel.y
+        assert x >= 0 and y >= 0
+        return "R{}C{}_{}".format(y, x, loctype_wire_names[loctype_at[y][x]][idx])
 
     bba = BinaryBlobAssembler()
-    bba.pre('#include "nextpnr.h"')
-    bba.pre('#include "embed.h"')
-    bba.pre('NEXTPNR_NAMESPACE_BEGIN')
-    bba.post('EmbeddedFile chipdb_file_%s("ecp5/chipdb-%s.bin", chipdb_blob_%s);' % (dev_name, dev_name, dev_name))
-    bba.post('NEXTPNR_NAMESPACE_END')
-    bba.push("chipdb_blob_%s" % dev_name)
-    bba.r("chip_info", "chip_info")
 
+    # Each section is written by its own function, so that the temporary data for
+    # a section is released once it has been passed to bba
 
-    for idx in range(len(loctypes)):
+    def write_loctype(idx):
         loctype = ddrg.locationTypes[loctypes[idx]]
-        if len(loctype.arcs) > 0:
+        # Copy pytrellis vectors into Python lists once, so the loops below avoid the bindings
+        arcs = list(loctype.arcs)
+        wires = list(loctype.wires)
+        bels = list(loctype.bels)
+        if len(arcs) > 0:
             bba.l("loc%d_pips" % idx, "PipInfoPOD")
-            for arc in loctype.arcs:
-                write_loc(arc.srcWire.rel, "src")
-                write_loc(arc.sinkWire.rel, "dst")
-                bba.u16(arc.srcWire.id, "src_idx")
-                bba.u16(arc.sinkWire.id, "dst_idx")
-                src_name = get_wire_name(idx, arc.srcWire.rel, arc.srcWire.id)
-                snk_name = get_wire_name(idx, arc.sinkWire.rel, arc.sinkWire.id)
+            for arc in arcs:
+                src_wire = arc.srcWire
+                snk_wire = arc.sinkWire
+                src_rel = src_wire.rel
+                snk_rel = snk_wire.rel
+                src_id = src_wire.id
+                snk_id = snk_wire.id
+                bba.u16(src_rel.x, "src.x")
+                bba.u16(src_rel.y, "src.y")
+                bba.u16(snk_rel.x, "dst.x")
+                bba.u16(snk_rel.y, "dst.y")
+                bba.u16(src_id, "src_idx")
+                bba.u16(snk_id, "dst_idx")
+                src_name = get_wire_name(idx, src_rel, src_id)
+                snk_name = get_wire_name(idx, snk_rel, snk_id)
                 bba.u16(get_pip_class(src_name, snk_name), "timing_class")
-                bba.u8(get_tiletype_index(ddrg.to_str(arc.tiletype)), "tile_type")
+                bba.u8(get_tiletype_index(get_id_str(ddrg, arc.tiletype)), "tile_type")
                 cls = arc.cls
                 if cls == 1 and "PCS" in snk_name or "DCU" in snk_name or "DCU" in src_name:
                    cls = 2
                 bba.u8(cls, "pip_type")
                 bba.u16(arc.lutperm_flags, "lutperm_flags")
                 bba.u16(0, "padding")
-        if len(loctype.wires) > 0:
-            for wire_idx in range(len(loctype.wires)):
-                wire = loctype.wires[wire_idx]
-                if len(wire.arcsDownhill) > 0:
+        if len(wires) > 0:
+            wire_pips = []
+            for wire_idx in range(len(wires)):
+                wire = wires[wire_idx]
+                downhill = list(wire.arcsDownhill)
+                uphill = list(wire.arcsUphill)
+                bel_pins = list(wire.belPins)
+                wire_pips.append((len(uphill), len(downhill), len(bel_pins)))
+                if len(downhill) > 0:
                     bba.l("loc%d_wire%d_downpips" % (idx, wire_idx), "PipLocatorPOD")
-                    for dp in wire.arcsDownhill:
+                    for dp in downhill:
                         write_loc(dp.rel, "rel_loc")
                         bba.u32(dp.id, "index")
-                if len(wire.arcsUphill) > 0:
+                if len(uphill) > 0:
                     bba.l("loc%d_wire%d_uppips" % (idx, wire_idx), "PipLocatorPOD")
-                    for up in wire.arcsUphill:
+                    for up in uphill:
                         write_loc(up.rel, "rel_loc")
                         bba.u32(up.id, "index")
-                if len(wire.belPins) > 0:
+                if len(bel_pins) > 0:
                     bba.l("loc%d_wire%d_belpins" % (idx, wire_idx), "BelPortPOD")
-                    for bp in wire.belPins:
+                    for bp in bel_pins:
                         write_loc(bp.bel.rel, "rel_bel_loc")
                         bba.u32(bp.bel.id, "bel_index")
-                        bba.u32(constids[ddrg.to_str(bp.pin)], "port")
+                        bba.u32(get_id_constid(ddrg, bp.pin), "port")
             bba.l("loc%d_wires" % idx, "WireInfoPOD")
-            for wire_idx in range(len(loctype.wires)):
-                wire = loctype.wires[wire_idx]
-                bba.s(ddrg.to_str(wire.name), "name")
-                bba.u16(constids[wire_type(ddrg.to_str(wire.name))], "type")
-                if ("TILE_WIRE_" + ddrg.to_str(wire.name)) in gfx_wire_ids:
-                    bba.u16(gfx_wire_ids["TILE_WIRE_" + ddrg.to_str(wire.name)], "tile_wire")
+            for wire_idx in range(len(wires)):
+                num_uphill, num_downhill, num_bel_pins = wire_pips[wire_idx]
+                wire_name = loctype_wire_names[idx][wire_idx]
+                bba.s(wire_name, "name")
+                bba.u16(loctype_wire_types[idx][wire_idx], "type")
+                if ("TILE_WIRE_" + wire_name) in gfx_wire_ids:
+                    bba.u16(gfx_wire_ids["TILE_WIRE_" + wire_name], "tile_wire")
                 else:
                     bba.u16(0, "tile_wire")
-                bba.r_slice("loc%d_wire%d_uppips" % (idx, wire_idx) if len(wire.arcsUphill) > 0 else None, len(wire.arcsUphill), "pips_uphill")
-                bba.r_slice("loc%d_wire%d_downpips" % (idx, wire_idx) if len(wire.arcsDownhill) > 0 else None, len(wire.arcsDownhill), "pips_downhill")
-                bba.r_slice("loc%d_wire%d_belpins" % (idx, wire_idx) if len(wire.belPins) > 0 else None, len(wire.belPins), "bel_pins")
-
-        if len(loctype.bels) > 0:
-            for bel_idx in range(len(loctype.bels)):
-                bel = loctype.bels[bel_idx]
+                bba.r_slice("loc%d_wire%d_uppips" % (idx, wire_idx) if num_uphill > 0 else None, num_uphill, "pips_uphill")
+                bba.r_slice("loc%d_wire%d_downpips" % (idx, wire_idx) if num_downhill > 0 else None, num_downhill, "pips_downhill")
+                bba.r_slice("loc%d_wire%d_belpins" % (idx, wire_idx) if num_bel_pins > 0 else None, num_bel_pins, "bel_pins")
+
+        if len(bels) > 0:
+            bel_wires = []
+            for bel_idx in range(len(bels)):
+                bel = bels[bel_idx]
+                pins = list(bel.wires)
+                bel_wires.append(len(pins))
                 bba.l("loc%d_bel%d_wires" % (idx, bel_idx), "BelWirePOD")
-                for pin in bel.wires:
+                for pin in pins:
                     write_loc(pin.wire.rel, "rel_wire_loc")
                     bba.u32(pin.wire.id, "wire_index")
-                    bba.u32(constids[ddrg.to_str(pin.pin)], "port")
+                    bba.u32(get_id_constid(ddrg, pin.pin), "port")
                     bba.u32(int(pin.dir), "dir")
             bba.l("loc%d_bels" % idx, "BelInfoPOD")
-            for bel_idx in range(len(loctype.bels)):
-                bel = loctype.bels[bel_idx]
-                bba.s(ddrg.to_str(bel.name), "name")
-                bba.u32(constids[ddrg.to_str(bel.type)], "type")
+            for bel_idx in range(len(bels)):
+                bel = bels[bel_idx]
+                bba.s(get_id_str(ddrg, bel.name), "name")
+                bba.u32(get_id_constid(ddrg, bel.type), "type")
                 bba.u32(bel.z, "z")
-                bba.r_slice("loc%d_bel%d_wires" % (idx, bel_idx), len(bel.wires), "bel_wires")
-
-    bba.l("locations", "LocationTypePOD")
-    for idx in range(len(loctypes)):
-        loctype = ddrg.locationTypes[loctypes[idx]]
-        bba.r_slice("loc%d_bels" % idx if len(loctype.bels) > 0 else None, len(loctype.bels), "bel_data")
-        bba.r_slice("loc%d_wires" % idx if len(loctype.wires) > 0 else None, len(loctype.wires), "wire_data")
-        bba.r_slice("loc%d_pips" % idx if len(loctype.arcs) > 0 else None, len(loctype.arcs), "pips_data")
-
-    for y in range(0, max_row+1):
-        for x in range(0, max_col+1):
-            bba.l("tile_info_%d_%d" % (x, y), "TileNamePOD")
-            for tile in chip.get_tiles_by_position(y, x):
-                bba.s(tile.info.name, "name")
-                bba.u16(get_tiletype_index(tile.info.type), "type_idx")
-                bba.u16(0, "padding")
-
-    bba.l("tiles_info", "TileInfoPOD")
-    for y in range(0, max_row+1):
-        for x in range(0, max_col+1):
-            bba.r_slice("tile_info_%d_%d" % (x, y), len(chip.get_tiles_by_position(y, x)), "tile_names")
-
-    bba.l("location_types", "int32_t")
-    for y in range(0, max_row+1):
-        for x in range(0, max_col+1):
-            bba.u32(loctypes.index(ddrg.typeAtLocation[pytrellis.Location(x, y)]), "loctype")
-
-    bba.l("location_glbinfo", "GlobalInfoPOD")
-    for y in range(0, max_row+1):
-        for x in range(0, max_col+1):
-            bba.u16(global_data[x, y][2], "tap_col")
-            bba.u8(global_data[x, y][1], "tap_dir")
-            bba.u8(global_data[x, y][0], "quad")
-            bba.u16(global_data[x, y][3][1], "spine_row")
-            bba.u16(global_data[x, y][3][0], "spine_col")
-
-    for package, pkgdata in sorted(packages.items()):
-        bba.l("package_data_%s" % package, "PackagePinPOD")
-        for pin in pkgdata:
-            name, loc, bel_idx = pin
-            bba.s(name, "name")
-            write_loc(loc, "abs_loc")
+                bba.r_slice("loc%d_bel%d_wires" % (idx, bel_idx), bel_wires[bel_idx], "bel_wires")
+
+        return len(bels), len(wires), len(arcs)
+
+    def write_locations(loctype_sizes):
+        bba.l("locations", "LocationTypePOD")
+        for idx in range(len(loctypes)):
+            num_bels, num_wires, num_arcs = loctype_sizes[idx]
+            bba.r_slice("loc%d_bels" % idx if num_bels > 0 else None, num_bels, "bel_data")
+            bba.r_slice("loc%d_wires" % idx if num_wires > 0 else None, num_wires, "wire_data")
+            bba.r_slice("loc%d_pips" % idx if num_arcs > 0 else None, num_arcs, "pips_data")
+
+    def write_tile_info():
+        tile_counts = []
+        for y in range(0, max_row+1):
+            for x in range(0, max_col+1):
+                tiles = chip.get_tiles_by_position(y, x)
+                tile_counts.append(len(tiles))
+                bba.l("tile_info_%d_%d" % (x, y), "TileNamePOD")
+                for tile in tiles:
+                    info = tile.info
+                    bba.s(info.name, "name")
+                    bba.u16(get_tiletype_index(info.type), "type_idx")
+                    bba.u16(0, "padding")
+
+        bba.l("tiles_info", "TileInfoPOD")
+        for y in range(0, max_row+1):
+            for x in range(0, max_col+1):
+                bba.r_slice("tile_info_%d_%d" % (x, y), tile_counts[y * (max_col + 1) + x], "tile_names")
+
+    def write_location_info():
+        bba.l("location_types", "int32_t")
+        for y in range(0, max_row+1):
+            for x in range(0, max_col+1):
+                bba.u32(loctype_at[y][x], "loctype")
+
+        bba.l("location_glbinfo", "GlobalInfoPOD")
+        for tap_col, tap_dir, quad, spine_row, spine_col in zip(global_tap_col, global_tap_dir, global_quad,
+                                                                global_spine_row, global_spine_col):
+            bba.u16(tap_col, "tap_col")
+            bba.u8(tap_dir, "tap_dir")
+            bba.u8(quad, "quad")
+            bba.u16(spine_row, "spine_row")
+            bba.u16(spine_col, "spine_col")
+
+    def write_packages():
+        pkg_sorted = sorted(packages.items())
+        for package, pkgdata in pkg_sorted:
+            bba.l("package_data_%s" % package, "PackagePinPOD")
+            for pin in pkgdata:
+                name, x, y, bel_idx = pin
+                bba.s(name, "name")
+                bba.u16(x, "abs_loc.x")
+                bba.u16(y, "abs_loc.y")
+                bba.u32(bel_idx, "bel_index")
+
+        bba.l("package_data", "PackageInfoPOD")
+        for package, pkgdata in pkg_sorted:
+            bba.s(package, "name")
+            bba.r_slice("package_data_%s" % package, len(pkgdata), "pin_data")
+
+    def write_pios():
+        bba.l("pio_info", "PIOInfoPOD")
+        for pin in pindata:
+            x, y, bel_idx, bank, func, dqs = pin
+            bba.u16(x, "abs_loc.x")
+            bba.u16(y, "abs_loc.y")
             bba.u32(bel_idx, "bel_index")
+            if func is not None and func != "WRITEN":
+                bba.s(func, "function_name")
+            else:
+                bba.r(None, "function_name")
+            bba.u16(bank, "bank")
+            bba.u16(dqs, "dqsgroup")
+
+    def write_tiletype_names():
+        bba.l("tiletype_names", "RelPtr<char>")
+        for tt, idx in sorted(tiletype_names.items(), key=lambda x: x[1]):
+            bba.s(tt, "name")
+
+    def write_timing():
+        for grade in speed_grade_names:
+            for cell in speed_grade_cells[grade]:
+                celltype, delays, setupholds = cell
+                if len(delays) > 0:
+                    bba.l("cell_%d_delays_%s" % (celltype, grade))
+                    for delay in delays:
+                        from_pin, to_pin, min_delay, max_delay = delay
+                        bba.u32(from_pin, "from_pin")
+                        bba.u32(to_pin, "to_pin")
+                        bba.u32(min_delay, "min_delay")
+                        bba.u32(max_delay, "max_delay")
+                if len(setupholds) > 0:
+                    bba.l("cell_%d_setupholds_%s" % (celltype, grade))
+                    for sh in setupholds:
+                        pin, clock, min_setup, max_setup, min_hold, max_hold = sh
+                        bba.u32(pin, "sig_port")
+                        bba.u32(clock, "clock_port")
+                        bba.u32(min_setup, "min_setup")
+                        bba.u32(max_setup, "max_setup")
+                        bba.u32(min_hold, "min_hold")
+                        bba.u32(max_hold, "max_hold")
+            bba.l("cell_timing_data_%s" % grade)
+            for cell in speed_grade_cells[grade]:
+                celltype, delays, setupholds = cell
+                bba.u32(celltype, "cell_type")
+                bba.r_slice("cell_%d_delays_%s" % (celltype, grade) if len(delays) > 0 else None, len(delays), "delays")
+                bba.r_slice("cell_%d_setupholds_%s" % (celltype, grade) if len(delays) > 0 else None, len(setupholds), "setupholds")
+            bba.l("pip_timing_data_%s" % grade)
+            for pipclass in speed_grade_pips[grade]:
+                min_delay, max_delay, min_fanout, max_fanout = pipclass
+                bba.u32(min_delay, "min_delay")
+                bba.u32(max_delay, "max_delay")
+                bba.u32(min_fanout, "min_fanout")
+                bba.u32(max_fanout, "max_fanout")
+        bba.l("speed_grade_data")
+        for grade in speed_grade_names:
+            bba.r_slice("cell_timing_data_%s" % grade, len(speed_grade_cells[grade]), "cell_timings")
+            bba.r_slice("pip_timing_data_%s" % grade, len(speed_grade_pips[grade]), "pip_classes")
+
+    def write_chip_info():
+        bba.l("chip_info")
+        bba.u32(max_col + 1, "width")
+        bba.u32(max_row + 1, "height")
+        bba.u32((max_col + 1) * (max_row + 1), "num_tiles")
+        bba.u32(const_id_count, "const_id_count")
+
+        bba.r_slice("locations", len(loctypes), "locations")
+        bba.r_slice("location_types", (max_col + 1) * (max_row + 1), "location_type")
+        bba.r_slice("location_glbinfo", (max_col + 1) * (max_row + 1), "location_glbinfo")
+        bba.r_slice("tiletype_names", len(tiletype_names), "tiletype_names")
+        bba.r_slice("package_data", len(packages), "package_info")
+        bba.r_slice("pio_info", len(pindata), "pio_info")
+        bba.r_slice("tiles_info", (max_col + 1) * (max_row + 1), "tile_info")
+        bba.r_slice("speed_grade_data", len(speed_grade_names), "speed_grades")
 
-    bba.l("package_data", "PackageInfoPOD")
-    for package, pkgdata in sorted(packages.items()):
-        bba.s(package, "name")
-        bba.r_slice("package_data_%s" % package, len(pkgdata), "pin_data")
-
-    bba.l("pio_info", "PIOInfoPOD")
-    for pin in pindata:
-        loc, bel_idx, bank, func, dqs = pin
-        write_loc(loc, "abs_loc")
-        bba.u32(bel_idx, "bel_index")
-        if func is not None and func != "WRITEN":
-            bba.s(func, "function_name")
-        else:
-            bba.r(None, "function_name")
-        bba.u16(bank, "bank")
-        bba.u16(dqs, "dqsgroup")
-
-    bba.l("tiletype_names", "RelPtr<char>")
-    for tt, idx in sorted(tiletype_names.items(), key=lambda x: x[1]):
-        bba.s(tt, "name")
+    bba.pre('#include "nextpnr.h"')
+    bba.pre('#include "embed.h"')
+    bba.pre('NEXTPNR_NAMESPACE_BEGIN')
+    bba.post('EmbeddedFile chipdb_file_%s("ecp5/chipdb-%s.bin", chipdb_blob_%s);' % (dev_name, dev_name, dev_name))
+    bba.post('NEXTPNR_NAMESPACE_END')
+    bba.push("chipdb_blob_%s" % dev_name)
+    bba.r("chip_info", "chip_info")
 
-    for grade in speed_grade_names:
-        for cell in speed_grade_cells[grade]:
-            celltype, delays, setupholds = cell
-            if len(delays) > 0:
-                bba.l("cell_%d_delays_%s" % (celltype, grade))
-                for delay in delays:
-                    from_pin, to_pin, min_delay, max_delay = delay
-                    bba.u32(from_pin, "from_pin")
-                    bba.u32(to_pin, "to_pin")
-                    bba.u32(min_delay, "min_delay")
-                    bba.u32(max_delay, "max_delay")
-            if len(setupholds) > 0:
-                bba.l("cell_%d_setupholds_%s" % (celltype, grade))
-                for sh in setupholds:
-                    pin, clock, min_setup, max_setup, min_hold, max_hold = sh
-                    bba.u32(pin, "sig_port")
-                    bba.u32(clock, "clock_port")
-                    bba.u32(min_setup, "min_setup")
-                    bba.u32(max_setup, "max_setup")
-                    bba.u32(min_hold, "min_hold")
-                    bba.u32(max_hold, "max_hold")
-        bba.l("cell_timing_data_%s" % grade)
-        for cell in speed_grade_cells[grade]:
-            celltype, delays, setupholds = cell
-            bba.u32(celltype, "cell_type")
-            bba.r_slice("cell_%d_delays_%s" % (celltype, grade) if len(delays) > 0 else None, len(delays), "delays")
-            bba.r_slice("cell_%d_setupholds_%s" % (celltype, grade) if len(delays) > 0 else None, len(setupholds), "setupholds")
-        bba.l("pip_timing_data_%s" % grade)
-        for pipclass in speed_grade_pips[grade]:
-            min_delay, max_delay, min_fanout, max_fanout = pipclass
-            bba.u32(min_delay, "min_delay")
-            bba.u32(max_delay, "max_delay")
-            bba.u32(min_fanout, "min_fanout")
-            bba.u32(max_fanout, "max_fanout")
-    bba.l("speed_grade_data")
-    for grade in speed_grade_names:
-        bba.r_slice("cell_timing_data_%s" % grade, len(speed_grade_cells[grade]), "cell_timings")
-        bba.r_slice("pip_timing_data_%s" % grade, len(speed_grade_pips[grade]), "pip_classes")
-
-    bba.l("chip_info")
-    bba.u32(max_col + 1, "width")
-    bba.u32(max_row + 1, "height")
-    bba.u32((max_col + 1) * (max_row + 1), "num_tiles")
-    bba.u32(const_id_count, "const_id_count")
-
-    bba.r_slice("locations", len(loctypes), "locations")
-    bba.r_slice("location_types", (max_col + 1) * (max_row + 1), "location_type")
-    bba.r_slice("location_glbinfo", (max_col + 1) * (max_row + 1), "location_glbinfo")
-    bba.r_slice("tiletype_names", len(tiletype_names), "tiletype_names")
-    bba.r_slice("package_data", len(packages), "package_info")
-    bba.r_slice("pio_info", len(pindata), "pio_info")
-    bba.r_slice("tiles_info", (max_col + 1) * (max_row + 1), "tile_info")
-    bba.r_slice("speed_grade_data", len(speed_grade_names), "speed_grades")
+    loctype_sizes = [write_loctype(idx) for idx in range(len(loctypes))]
+    write_locations(loctype_sizes)
+    write_tile_info()
+    write_location_info()
+    write_packages()
+    write_pios()
+    write_tiletype_names()
+    write_timing()
+    write_chip_info()
 
     bba.pop()
+    bba.flush()
     return bba
 
 dev_names = {"25k": "LFE5UM5G-25F", "45k": "LFE5UM5G-45F", "85k": "LFE5UM5G-85F"}